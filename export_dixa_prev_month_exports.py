@@ -3,7 +3,9 @@
 Export Dixa Conversations - Previous Month (Exports API + Detail Enrichment)
 - Fetches previous calendar month's conversations via Exports API
 - Filters initial_channel == pstnphone (telephone)
-- Enriches each record with details from /v1/conversations/{id}
+- Answer time, queue and assignment reason come from the export record itself
+- Optionally (DIXA_ENRICH_DETAILS=true) enriches each record with details
+  from /v1/conversations/{id}
 - Computes metrics and writes conversations_prev_month.csv (UTF-8)
 
 NOTE: Exports previous calendar month only.
@@ -12,14 +14,27 @@ Use export_dixa_refresh.py with --range/--daily-files.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import csv
 import json
-import pandas as pd
+import sqlite3
+import numpy as np
 from datetime import datetime, timedelta
 import time
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
+from operator import itemgetter
 from dotenv import load_dotenv
 
+try:
+    import orjson  # optional, faster JSON parsing
+except ImportError:
+    orjson = None
+
 load_dotenv(override=True)
 
 # Configuration
@@ -39,8 +54,115 @@ HEADERS_EXPORTS = {
     "Accept": "application/json",
 }
 
-# Toggle detail enrichment (slower)
-ENRICH_DETAILS = True
+# Days per Exports API request; smaller windows keep each response small
+EXPORT_WINDOW_DAYS = int(os.getenv("DIXA_WINDOW_DAYS", "7"))
+BASE_DELAY = float(os.getenv("DIXA_BASE_DELAY", "7.5"))  # minimum wait after a 429
+# Exports API requests per second; by default one window every BASE_DELAY seconds
+EXPORTS_RATE = float(os.getenv("DIXA_EXPORTS_RATE") or 1 / max(BASE_DELAY, 0.1))
+
+# Only request the export columns build_rows uses
+EXPORT_FIELDS = (
+    "id,initial_channel,direction,created_at,queued_at,assigned_at,closed_at,"
+    "queue_id,queue_name,assignee_id,assignee_name"
+)
+
+# Plain export columns copied into each row, looked up in one C-level call
+EXPORT_BASIC_KEYS = ("id", "direction", "assignee_id", "assignee_name", "queue_id", "queue_name")
+_export_basic = itemgetter(*EXPORT_BASIC_KEYS)
+
+# CSV column order of conversations_prev_month.csv
+FIELDS = [
+    "id",
+    "createdAt",
+    "answeredAt",
+    "closedAt",
+    "state",
+    "direction",
+    "channel",
+    "assigneeId",
+    "assigneeName",
+    "queueId",
+    "queueName",
+    "assignmentReason",
+    "AnsweredWithin1Min",
+    "TakenFromQueue",
+    "TakenFromForward",
+    "RejectedOrForwarded",
+]
+
+# Number of detail requests kept in flight at once
+DETAIL_CONCURRENCY = int(os.getenv("DIXA_DETAIL_CONCURRENCY", "20"))
+# Detail requests per second, shared by all detail workers
+DETAIL_RATE = float(os.getenv("DIXA_DETAIL_RATE", "10"))
+
+# One pooled session for all calls: keep-alive avoids a TLS handshake per request.
+# The pool holds at least one connection per detail worker so none are discarded.
+# urllib3 retries 429/5xx only on the v1 API: Exports errors are handled in
+# fetch_exports so BASE_DELAY-scale waits and the limiter slow-down apply.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[], raise_on_status=False),
+))
+SESSION.mount(BASE_V1, HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=max(50, DETAIL_CONCURRENCY),
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=True, raise_on_status=False),
+))
+SESSION.headers.update(HEADERS_EXPORTS)
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` requests per second.
+
+    slow_down() halves the rate after a 429; every acquire() then lets it
+    recover a little until it is back at the configured rate.
+    """
+
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.allowance = max(rate, 1.0)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(max(self.rate, 1.0), self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            if self.allowance < 1.0:
+                time.sleep((1.0 - self.allowance) / self.rate)
+                self.last = time.monotonic()
+                self.allowance = 0.0
+            else:
+                self.allowance -= 1.0
+            self.rate = min(self.max_rate, self.rate * 1.05)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+
+
+EXPORTS_LIMITER = RateLimiter(EXPORTS_RATE)
+DETAIL_LIMITER = RateLimiter(DETAIL_RATE)
+
+
+def retry_after_seconds(r, default):
+    try:
+        return float(r.headers.get("Retry-After") or default)
+    except ValueError:
+        return default
+
+# Toggle detail enrichment (slower): one extra request per conversation, only adds
+# `state` and refines answeredAt/assignmentReason/queue already present in the export
+ENRICH_DETAILS = os.getenv("DIXA_ENRICH_DETAILS", "false").lower() == "true"
+
+# On-disk cache of detail responses; conversations in a terminal state never change
+DETAIL_CACHE_PATH = os.getenv("DIXA_DETAIL_CACHE", "dixa_detail_cache.sqlite")
+TERMINAL_STATES = ("closed", "abandoned")
 
 
 def get_previous_month_range():
@@ -66,112 +188,279 @@ def parse_cli_range():
     return get_previous_month_range()
 
 
-def ms_to_iso(ms):
-    if ms is None:
-        return None
-    try:
-        return datetime.utcfromtimestamp(int(ms) / 1000).strftime("%Y-%m-%dT%H:%M:%SZ")
-    except Exception:
-        return None
+def json_loads(data):
+    """Parse JSON bytes/str, using orjson when installed."""
+    return orjson.loads(data) if orjson else json.loads(data)
 
 
-def fetch_exports(start_date, end_date):
-    url = f"{BASE_EXPORTS}/conversation_export?created_after={start_date}&created_before={end_date}"
-    try:
-        resp = requests.get(url, headers=HEADERS_EXPORTS, timeout=60)
+def json_dumps(obj):
+    return orjson.dumps(obj) if orjson else json.dumps(obj)
+
+
+def ms_array(values):
+    """Return (int64 epoch-ms array, present mask) for a list of ms values (None = missing)."""
+    present = np.array([v is not None for v in values], dtype=bool)
+    ms = np.array([0 if v is None else int(v) for v in values], dtype=np.int64)
+    return ms, present
+
+
+def ms_to_iso_array(values):
+    """Convert a list of epoch-ms values (None = missing) to ISO strings in one numpy pass."""
+    ms, present = ms_array(values)
+    iso = np.char.add(np.datetime_as_string(ms.astype("datetime64[ms]"), unit="s"), "Z").astype(object)
+    iso[~present] = None
+    return iso.tolist()
+
+
+def fetch_exports(start_date, end_date, max_retries=6):
+    """Fetch one export window; None when the request failed."""
+    url = (
+        f"{BASE_EXPORTS}/conversation_export?created_after={start_date}&created_before={end_date}"
+        f"&fields={EXPORT_FIELDS}"
+    )
+    delay = BASE_DELAY
+    for _ in range(max_retries):
+        EXPORTS_LIMITER.acquire()
+        try:
+            resp = SESSION.get(url, timeout=60)
+        except Exception as e:
+            print(f"ERROR: Exports API request failed: {e}")
+            return None
+        if resp.status_code == 429:
+            EXPORTS_LIMITER.slow_down()
+            wait = max(retry_after_seconds(resp, delay), BASE_DELAY)
+            print(f"429 rate limited, waiting {wait:.1f}s ...")
+            time.sleep(wait)
+            delay = min(delay * 1.5, 60)
+            continue
+        if 500 <= resp.status_code < 600:
+            print(f"Exports API {resp.status_code}, retrying in {delay:.1f}s ...")
+            time.sleep(delay)
+            delay = min(delay * 1.5, 60)
+            continue
         if resp.status_code != 200:
             print(f"ERROR: Exports API {resp.status_code}: {resp.text[:300]}")
-            return []
+            return None
         try:
-            data = resp.json()
-        except json.JSONDecodeError:
+            data = json_loads(resp.content)
+        except ValueError:
             print("ERROR: Exports API did not return JSON")
-            return []
+            return None
         if isinstance(data, list):
             return data
         # Some deployments wrap as {data: [...]}
         return data.get("data", [])
-    except Exception as e:
-        print(f"ERROR: Exports API request failed: {e}")
-        return []
+    print(f"ERROR: Exports API still failing after {max_retries} attempts")
+    return None
+
+
+def fetch_telephone_exports(start_date, end_date):
+    """Fetch the range window by window and keep only telephone records.
+
+    Returns (records, total_seen); records is None when a window failed, so a
+    partial month is never written. Each window's response is dropped as soon
+    as it is filtered, so memory holds one window of all-channel data at most.
+    """
+    records = []
+    total_seen = 0
+    cur = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    # created_before is exclusive: consecutive windows share their boundary date, so
+    # they neither overlap nor leave gaps, and the last one stops at end_date
+    while True:
+        win_end = min(end, cur + timedelta(days=EXPORT_WINDOW_DAYS))
+        batch = fetch_exports(cur.strftime("%Y-%m-%d"), win_end.strftime("%Y-%m-%d"))
+        if batch is None:
+            print(f"ERROR: window {cur:%Y-%m-%d} -> {win_end:%Y-%m-%d} failed")
+            return None, total_seen
+        total_seen += len(batch)
+        records.extend(rec for rec in batch if (rec.get("initial_channel") or "").lower() == "pstnphone")
+        if win_end >= end:
+            break
+        cur = win_end
+    return records, total_seen
 
 
 def fetch_detail(conversation_id):
     url = f"{BASE_V1}/conversations/{conversation_id}"
     try:
-        r = requests.get(url, headers=HEADERS_V1, timeout=30)
+        DETAIL_LIMITER.acquire()
+        r = SESSION.get(url, headers=HEADERS_V1, timeout=30)
+        if r.status_code == 429:
+            # Still throttled after urllib3's retries: lower our own request rate
+            DETAIL_LIMITER.slow_down()
         if r.status_code != 200:
             return None
-        j = r.json()
+        j = json_loads(r.content)
         return j.get("data")
     except Exception:
         return None
 
 
-def calculate_metrics_from_ms(created_at_ms, assigned_at_ms, queued_at_ms):
-    answered_within_1min = False
-    if created_at_ms and assigned_at_ms:
-        try:
-            answered_within_1min = (int(assigned_at_ms) - int(created_at_ms)) <= 60000
-        except Exception:
-            answered_within_1min = False
+_cache_db = None
+_cache_pending = []
+
+
+def get_cache_db():
+    global _cache_db
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(DETAIL_CACHE_PATH)
+        _cache_db.execute("PRAGMA journal_mode=WAL")
+        _cache_db.execute("PRAGMA synchronous=NORMAL")
+        _cache_db.execute("CREATE TABLE IF NOT EXISTS d(id TEXT PRIMARY KEY, state TEXT, json BLOB, fetched_at INTEGER)")
+    return _cache_db
+
+
+def get_cached_detail(conversation_id):
+    """Return cached details for a conversation in a terminal state, else None."""
+    row = get_cache_db().execute("SELECT state, json FROM d WHERE id=?", (str(conversation_id),)).fetchone()
+    if row and (row[0] or "").lower() in TERMINAL_STATES:
+        return json_loads(row[1])
+    return None
+
+
+def store_detail(conversation_id, details):
+    _cache_pending.append((str(conversation_id), details.get("state"), json_dumps(details), int(time.time())))
+    # Write in batches; one commit per insert would pay an fsync per detail
+    if len(_cache_pending) >= 500:
+        flush_detail_cache()
+
+
+def flush_detail_cache():
+    if not _cache_pending:
+        return
+    db = get_cache_db()
+    with db:
+        db.executemany("INSERT OR REPLACE INTO d VALUES(?,?,?,?)", _cache_pending)
+    _cache_pending.clear()
+
+
+def calculate_metrics(created, assigned, queued):
+    """Compute the metric columns for all rows at once from (ms, present) arrays.
+
+    Returns lists indexed by row position: answered within 1 minute, rejected or
+    forwarded, taken from queue, taken from forward and the derived assignmentReason.
+    """
+    created_ms, has_created = created
+    assigned_ms, has_assigned = assigned
+    _, has_queued = queued
+
+    answered_within_1min = has_created & has_assigned & ((assigned_ms - created_ms) <= 60000)
 
     # Not answered if no assigned_at
-    rejected_or_forwarded = assigned_at_ms is None
+    rejected_or_forwarded = ~has_assigned
 
     # Queue vs forward inferred from queued_at presence
-    taken_from_queue = (queued_at_ms is not None) and (assigned_at_ms is not None)
-    taken_from_forward = (queued_at_ms is None) and (assigned_at_ms is not None)
+    taken_from_queue = has_queued & has_assigned
+    taken_from_forward = ~has_queued & has_assigned
 
     # Derive a human assignmentReason for CSV
-    assignment_reason = None
-    if taken_from_queue:
-        assignment_reason = "queue"
-    elif taken_from_forward:
-        assignment_reason = "forward"
+    assignment_reason = np.where(taken_from_queue, "queue", np.where(taken_from_forward, "forward", None))
+
+    return (
+        answered_within_1min.tolist(),
+        rejected_or_forwarded.tolist(),
+        taken_from_queue.tolist(),
+        taken_from_forward.tolist(),
+        assignment_reason.tolist(),
+    )
 
-    return answered_within_1min, rejected_or_forwarded, taken_from_queue, taken_from_forward, assignment_reason
 
+def export_basic_fields(rec):
+    """Return the EXPORT_BASIC_KEYS values of an export record (None when absent)."""
+    try:
+        return _export_basic(rec)
+    except KeyError:
+        return tuple(rec.get(k) for k in EXPORT_BASIC_KEYS)
+
+
+def fetch_details(conv_ids):
+    """Fetch conversation details concurrently; returns {id: details or None}.
+
+    Details of closed conversations are served from the on-disk cache.
+    """
+    details = {}
+    to_fetch = []
+    for conv_id in conv_ids:
+        cached = get_cached_detail(conv_id)
+        if cached is not None:
+            details[conv_id] = cached
+        else:
+            to_fetch.append(conv_id)
+    print(f"Details from cache: {len(details)}, to fetch: {len(to_fetch)}")
+    sys.stdout.flush()
 
-def build_rows(exports_rows):
-    rows = []
+    total = len(to_fetch)
     detail_ok = 0
     detail_fail = 0
-    
-    # Pre-filter candidates to know total upfront
-    candidates = [rec for rec in exports_rows if (rec.get("initial_channel") or "").lower() == "pstnphone"]
+    try:
+        with ThreadPoolExecutor(max_workers=DETAIL_CONCURRENCY) as ex:
+            futures = {ex.submit(fetch_detail, conv_id): conv_id for conv_id in to_fetch}
+            for idx, fut in enumerate(as_completed(futures), 1):
+                conv_id = futures[fut]
+                details[conv_id] = fut.result()
+                if details[conv_id]:
+                    detail_ok += 1
+                    store_detail(conv_id, details[conv_id])
+                else:
+                    detail_fail += 1
+                # Progress output every 50 items
+                if idx % 50 == 0 or idx == total:
+                    print(f"Processed {idx}/{total} (details ok={detail_ok}, failed={detail_fail})")
+                    sys.stdout.flush()
+    finally:
+        # Keep what was fetched even if the run is interrupted
+        flush_detail_cache()
+    return details
+
+
+def build_rows(candidates, stats):
+    """Yield one CSV row per telephone conversation.
+
+    Counters (total, detail_ok, detail_fail) are kept in the `stats` dict.
+    """
     total = len(candidates)
+    stats["total"] = total
     print(f"Telephone candidates to process: {total}")
     sys.stdout.flush()
 
-    for idx, rec in enumerate(candidates, 1):
-        conv_id = rec.get("id")
-        created_at_ms = rec.get("created_at")
-        queued_at_ms = rec.get("queued_at")
-        assigned_at_ms = rec.get("assigned_at")
-        closed_at_ms = rec.get("closed_at")
-
-        created_at = ms_to_iso(created_at_ms)
-        closed_at = ms_to_iso(closed_at_ms)
-        answered_at = ms_to_iso(assigned_at_ms)
-        direction = rec.get("direction")
-        assignee_id = rec.get("assignee_id")
-        assignee_name = rec.get("assignee_name")
-        queue_id = rec.get("queue_id")
-        queue_name = rec.get("queue_name")
+    # Fetch all details up front so the requests overlap instead of running one by one
+    details_by_id = {}
+    if ENRICH_DETAILS:
+        conv_ids = [rec.get("id") for rec in candidates if rec.get("id") is not None]
+        details_by_id = fetch_details(conv_ids)
+
+    # Convert timestamps and compute metrics for all rows up front
+    created_iso = ms_to_iso_array([rec.get("created_at") for rec in candidates])
+    closed_iso = ms_to_iso_array([rec.get("closed_at") for rec in candidates])
+    answered_iso = ms_to_iso_array([rec.get("assigned_at") for rec in candidates])
+    ans1m_all, rej_fwd_all, from_queue_all, from_forward_all, reason_all = calculate_metrics(
+        ms_array([rec.get("created_at") for rec in candidates]),
+        ms_array([rec.get("assigned_at") for rec in candidates]),
+        ms_array([rec.get("queued_at") for rec in candidates]),
+    )
+
+    for i, rec in enumerate(candidates):
+        conv_id, direction, assignee_id, assignee_name, queue_id, queue_name = export_basic_fields(rec)
+
+        created_at = created_iso[i]
+        closed_at = closed_iso[i]
+        answered_at = answered_iso[i]
         channel = "PstnPhone"
 
-        # Compute metrics from exports timestamps
-        ans1m, rej_fwd, from_queue, from_forward, assignment_reason = calculate_metrics_from_ms(
-            created_at_ms, assigned_at_ms, queued_at_ms
-        )
+        # Metrics from exports timestamps
+        ans1m = ans1m_all[i]
+        rej_fwd = rej_fwd_all[i]
+        from_queue = from_queue_all[i]
+        from_forward = from_forward_all[i]
+        assignment_reason = reason_all[i]
 
         # Optional: enrich with details (state, answeredAt refinement)
         state = None
         if ENRICH_DETAILS and conv_id is not None:
-            details = fetch_detail(conv_id)
+            details = details_by_id.get(conv_id)
             if details:
-                detail_ok += 1
+                stats["detail_ok"] += 1
                 state = details.get("state")
                 # If answeredAt exists in details, prefer it
                 answered_at = details.get("answeredAt") or answered_at
@@ -183,9 +472,9 @@ def build_rows(exports_rows):
                 queue_id = q.get("id") or queue_id
                 queue_name = q.get("name") or queue_name
             else:
-                detail_fail += 1
+                stats["detail_fail"] += 1
 
-        rows.append({
+        yield {
             "id": conv_id,
             "createdAt": created_at,
             "answeredAt": answered_at,
@@ -202,17 +491,7 @@ def build_rows(exports_rows):
             "TakenFromQueue": from_queue,
             "TakenFromForward": from_forward,
             "RejectedOrForwarded": rej_fwd,
-        })
-
-        # Be nice to the API if enriching
-        if ENRICH_DETAILS:
-            # Progress output every 50 items
-            if idx % 50 == 0 or idx == total:
-                print(f"Processed {idx}/{total} (details ok={detail_ok}, failed={detail_fail})")
-                sys.stdout.flush()
-            time.sleep(0.1)
-
-    return rows, detail_ok, detail_fail, total
+        }
 
 
 def main():
@@ -222,28 +501,37 @@ def main():
     start_date, end_date = parse_cli_range()
     print(f"Period: {start_date} to {end_date}")
 
-    exports_rows = fetch_exports(start_date, end_date)
-    print(f"Exports returned: {len(exports_rows)} records (all channels)")
-
-    rows, detail_ok, detail_fail, total_candidates = build_rows(exports_rows)
-    print(f"Telephone conversations after filter: {len(rows)} (from {total_candidates} candidates)")
-    print(f"Details fetched: ok={detail_ok}, failed={detail_fail}")
-
-    if not rows:
+    candidates, total_seen = fetch_telephone_exports(start_date, end_date)
+    if candidates is None:
+        print("Export incomplete, nothing written")
+        sys.exit(1)
+    print(f"Exports returned: {total_seen} records (all channels)")
+
+    stats = {"total": 0, "detail_ok": 0, "detail_fail": 0}
+    rows = build_rows(candidates, stats)
+    first = next(rows, None)
+    if first is None:
+        print(f"Telephone conversations after filter: 0 (from {stats['total']} candidates)")
+        print(f"Details fetched: ok={stats['detail_ok']}, failed={stats['detail_fail']}")
         print("No conversations to export")
         return
 
-    df = pd.DataFrame(rows)
+    # Stream rows to disk and count the summary in the same pass
+    total_calls = calls_1m = not_answered_or_fwd = from_queue = from_forward = 0
     out = "conversations_prev_month.csv"
-    df.to_csv(out, index=False, encoding="utf-8")
-    print(f"Wrote {len(df)} rows to {out}")
-
-    # Summary
-    total_calls = len(df)
-    calls_1m = int(df["AnsweredWithin1Min"].sum()) if "AnsweredWithin1Min" in df.columns else 0
-    not_answered_or_fwd = int(df["RejectedOrForwarded"].sum()) if "RejectedOrForwarded" in df.columns else 0
-    from_queue = int(df["TakenFromQueue"].sum()) if "TakenFromQueue" in df.columns else 0
-    from_forward = int(df["TakenFromForward"].sum()) if "TakenFromForward" in df.columns else 0
+    with open(out, "w", encoding="utf-8", newline="", buffering=1 << 20) as f:
+        w = csv.DictWriter(f, fieldnames=FIELDS, lineterminator="\n")
+        w.writeheader()
+        for row in chain([first], rows):
+            w.writerow(row)
+            total_calls += 1
+            calls_1m += row["AnsweredWithin1Min"]
+            not_answered_or_fwd += row["RejectedOrForwarded"]
+            from_queue += row["TakenFromQueue"]
+            from_forward += row["TakenFromForward"]
+    print(f"Telephone conversations after filter: {total_calls} (from {stats['total']} candidates)")
+    print(f"Details fetched: ok={stats['detail_ok']}, failed={stats['detail_fail']}")
+    print(f"Wrote {total_calls} rows to {out}")
 
     print("\n" + "-" * 60)
     print("SUMMARY")
@@ -17,6 +17,11 @@ import sys
 import time
 import os
 import json
+import gzip
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -25,7 +30,20 @@ from typing import Dict, List, Tuple, Any, Optional
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
+try:
+    import orjson  # optional, faster JSON parsing
+except ImportError:
+    orjson = None
+try:
+    import pyarrow as pa  # optional, only needed for --format parquet/both
+    import pyarrow.parquet as pq
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = pq = pc = ds = None
 
 API_KEY = os.getenv("DIXA_TOKEN"); assert API_KEY, "Set DIXA_TOKEN"
 USE_BEARER = os.getenv("DIXA_USE_BEARER", "true").lower() == "true"
@@ -52,7 +70,28 @@ DEFAULT_END_ISO = os.getenv("DIXA_END_ISO")  # optional
 
 # Windowed export config
 WINDOW_DAYS = int(os.getenv("DIXA_WINDOW_DAYS", "7"))  # 7 = week
-BASE_DELAY = float(os.getenv("DIXA_BASE_DELAY", "7.5"))  # seconds between windows
+BASE_DELAY = float(os.getenv("DIXA_BASE_DELAY", "7.5"))  # minimum wait after a 429
+WINDOW_WORKERS = int(os.getenv("DIXA_WINDOW_WORKERS", "4"))  # windows fetched in parallel
+# Exports API requests per second; by default one request every BASE_DELAY seconds
+EXPORTS_RATE = float(os.getenv("DIXA_EXPORTS_RATE") or 1 / max(BASE_DELAY, 0.1))
+DETAIL_RATE = float(os.getenv("DIXA_DETAIL_RATE", "10"))  # /conversations/{id} requests per second
+DETAIL_CONCURRENCY = int(os.getenv("DIXA_DETAIL_CONCURRENCY", "20"))  # detail requests in flight
+# One /conversations/{id} request per uncached conversation; "false" derives the
+# assignment reason from the export record instead, as the prev-month script does.
+# Separate from prev-month's DIXA_ENRICH_DETAILS (default false) since both read .env
+ENRICH_DETAILS = os.getenv("DIXA_REFRESH_ENRICH_DETAILS", "true").lower() == "true"
+DEBUG = os.getenv("DIXA_DEBUG") == "1"
+CACHE_DIR = Path(os.getenv("DIXA_CACHE_DIR", ".cache/dixa"))  # cached export windows
+CACHE_MIN_AGE_DAYS = 7  # windows ending at least this long ago are treated as settled
+# Conversation details, shared with export_dixa_prev_month_exports.py (same schema)
+DETAIL_CACHE_PATH = os.getenv("DIXA_DETAIL_CACHE", "dixa_detail_cache.sqlite")
+TERMINAL_STATES = ("closed", "abandoned")
+
+# Export columns requested from the Exports API (same for every window)
+EXPORT_FIELDS = (
+    "id,initial_channel,direction,created_at,queued_at,assigned_at,closed_at,"
+    "queue_id,queue_name,assignee_id,assignee_name"
+)
 
 
 def parse_iso_utc(dt_str: str) -> datetime:
@@ -62,14 +101,16 @@ def parse_iso_utc(dt_str: str) -> datetime:
     - Accepts trailing Z or timezone offsets; result converted to UTC.
     """
     dt_str = dt_str.strip()
-    # Try YYYY-MM-DD first
+    # Fast path: stdlib handles YYYY-MM-DD and regular ISO 8601 (naive = UTC)
     try:
-        d = datetime.strptime(dt_str, "%Y-%m-%d").date()
-        return datetime(d.year, d.month, d.day, tzinfo=timezone.utc)
-    except Exception:
+        dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            return dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc)
+    except ValueError:
         pass
 
-    # Fallback to pandas for broader ISO parsing then normalize to UTC
+    # Fallback to pandas for exotic formats then normalize to UTC
     try:
         ts = pd.to_datetime(dt_str, utc=True)
         return ts.to_pydatetime()
@@ -91,7 +132,7 @@ def start_of_day_utc(d: date) -> datetime:
 
 
 def format_iso_z(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
 def determine_range_from_cli(argv: Optional[List[str]] = None) -> Tuple[datetime, datetime, str, argparse.Namespace]:
@@ -111,9 +152,22 @@ def determine_range_from_cli(argv: Optional[List[str]] = None) -> Tuple[datetime
                         help="Write single CSV conversations_ytd.csv (default)")
     parser.add_argument("--daily-files", action="store_true",
                         help="Write per-day CSVs to ./data/dixa_daily/")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always refetch export windows and conversation details instead of using the caches")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignore the checkpoint of an interrupted run and start over")
+    parser.add_argument("--format", choices=("csv", "parquet", "both"), default="csv",
+                        help="Single-file output format (parquet needs pyarrow)")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="With parquet output, write a year=/month= partitioned dataset to ./data/dixa_parquet/")
 
     args = parser.parse_args(argv)
 
+    if args.format != "csv" and pa is None:
+        parser.error("--format parquet/both requires pyarrow (pip install pyarrow)")
+    if args.partitioned and args.format == "csv":
+        parser.error("--partitioned requires --format parquet or both")
+
     # Default to single-file when neither flag is provided
     if not args.single_file and not args.daily_files:
         args.single_file = True
@@ -152,102 +206,169 @@ def determine_range_from_cli(argv: Optional[List[str]] = None) -> Tuple[datetime
 # Exports API helpers
 # ----------------------------
 
-def _ms_to_iso(ms):
-    if ms is None: return None
-    import pandas as pd
-    return pd.to_datetime(int(ms), unit="ms", utc=True).strftime("%Y-%m-%dT%H:%M:%SZ")
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` requests per second.
 
+    slow_down() halves the rate after a 429; every acquire() then lets it
+    recover a little until it is back at the configured rate.
+    """
 
-def ms_to_iso(ms):
-    return _ms_to_iso(ms)
+    def __init__(self, rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.allowance = max(rate, 1.0)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
 
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(max(self.rate, 1.0), self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            if self.allowance < 1.0:
+                time.sleep((1.0 - self.allowance) / self.rate)
+                self.last = time.monotonic()
+                self.allowance = 0.0
+            else:
+                self.allowance -= 1.0
+            self.rate = min(self.max_rate, self.rate * 1.05)
 
-def fetch_exports_day(day_iso: str) -> List[Dict[str, Any]]:
-    import requests
-    fields = (
-        "id,initial_channel,direction,created_at,queued_at,assigned_at,closed_at,"
-        "queue_id,queue_name,assignee_id,assignee_name"
-    )
-    url = (
-        f"{BASE_EXPORTS}/conversation_export?created_after={day_iso}&created_before={day_iso}"
-        f"&fields={fields}"
-    )
-    r = requests.get(url, headers=HEADERS_EXPORTS, timeout=60)
-    if r.status_code != 200:
-        print("Exports HTTP:", r.status_code, r.text[:300]); return []
+    def slow_down(self) -> None:
+        with self.lock:
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+
+
+EXPORTS_LIMITER = RateLimiter(EXPORTS_RATE)
+DETAIL_LIMITER = RateLimiter(DETAIL_RATE)
+
+
+def retry_after_seconds(r: requests.Response, default: float) -> float:
     try:
-        data = r.json()
-    except Exception:
-        return []
-    return data if isinstance(data, list) else data.get("data", [])
-
-
-def map_export_row(rec: dict) -> Dict[str, Any]:
-    ch = (rec.get("initial_channel") or "").lower()
-    return {
-      "id": rec.get("id"),
-      "createdAt": _ms_to_iso(rec.get("created_at")),
-      "queuedAt": _ms_to_iso(rec.get("queued_at")),
-      "answeredAt": _ms_to_iso(rec.get("assigned_at")),
-      "closedAt": _ms_to_iso(rec.get("closed_at")),
-      "direction": rec.get("direction"),
-      "channel": ch,
-      "assigneeId": rec.get("assignee_id"),
-      "assigneeName": rec.get("assignee_name"),
-      "queueId": rec.get("queue_id"),
-      "queueName": rec.get("queue_name"),
-    }
+        return float(r.headers.get("Retry-After") or default)
+    except ValueError:
+        return default
+
+
+_thread_local = threading.local()
+
+
+def new_session() -> requests.Session:
+    """Session with a keep-alive pool; connection errors are retried by urllib3.
+
+    The v1 API also retries 429 and 5xx (honouring Retry-After) inside urllib3; the
+    Exports API handles those statuses itself in fetch_exports_window, waiting
+    BASE_DELAY-scale delays so a short outage does not fail the window.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[], raise_on_status=False),
+    ))
+    session.mount(BASE_V1, HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                          respect_retry_after_header=True, raise_on_status=False),
+    ))
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the calling thread's Session so connections are kept alive."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = new_session()
+        _thread_local.session = session
+    return session
+
+
+def json_loads(data):
+    """Parse JSON bytes/str, using orjson when installed."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    """Serialize to JSON bytes, using orjson when installed."""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode("utf-8")
 
 
 def fetch_detail(conv_id: str) -> Optional[Dict[str, Any]]:
     url = f"{BASE_V1}/conversations/{conv_id}"
     try:
-        r = requests.get(url, headers=HEADERS_V1, timeout=30)
+        DETAIL_LIMITER.acquire()
+        r = get_session().get(url, headers=HEADERS_V1, timeout=30)
+        if r.status_code == 429:
+            # Still throttled after urllib3's retries: lower our own request rate
+            DETAIL_LIMITER.slow_down()
         if r.status_code != 200:
             return None
-        j = r.json()
+        j = json_loads(r.content)
         return j.get("data")
     except Exception:
         return None
 
 
-def map_row(rec: dict) -> Dict[str, Any]:
-    def ms_to_int(ms):
-        return None if ms is None else int(ms)
-
-    created_ms  = rec.get("created_at")
-    answered_ms = rec.get("assigned_at")
-    queued_ms   = rec.get("queued_at")
-    closed_ms   = rec.get("closed_at")
-
-    ans1m = (
-        created_ms is not None and answered_ms is not None
-        and (ms_to_int(answered_ms) - ms_to_int(created_ms)) <= 60_000
-    )
-
-    taken_from_queue   = (queued_ms  is not None and answered_ms is not None)
-    taken_from_forward = (queued_ms  is None     and answered_ms is not None)
-    rejected_or_fwd    = (answered_ms is None) or taken_from_forward
-
-    row = {
-      "id": rec.get("id"),
-      "createdAt": ms_to_iso(created_ms),
-      "queued_at":   ms_to_iso(queued_ms),
-      "assigned_at": ms_to_iso(answered_ms),
-      "answeredAt": ms_to_iso(answered_ms),
-      "queuedAt":   ms_to_iso(queued_ms),
-      "closedAt":   ms_to_iso(closed_ms),
-      "direction": (rec.get("direction") or ""),
-      "channel":   (rec.get("initial_channel") or "").lower(),
-      "assigneeName": rec.get("assignee_name"),
-      "queueName":    rec.get("queue_name"),
-      "AnsweredWithin1Min": ans1m,
-      "TakenFromQueue":     taken_from_queue,
-      "TakenFromForward":   taken_from_forward,
-      "RejectedOrForwarded": rejected_or_fwd
-    }
-
-    return row
+NAT_NS = np.iinfo(np.int64).min
+MISSING_MS = NAT_NS  # sentinel for absent epoch-ms values
+MS_COLS = ["createdAt_ms", "queuedAt_ms", "assigned_at_ms", "answeredAt_ms", "closedAt_ms"]
+
+
+def ms_column(records: List[dict], key: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Epoch-ms field of every record as (int64 values, present mask)."""
+    raw = [rec.get(key) for rec in records]
+    present = np.fromiter((v is not None for v in raw), dtype=bool, count=len(raw))
+    ms = np.fromiter((0 if v is None else int(v) for v in raw), dtype=np.int64, count=len(raw))
+    # Whole seconds, like the ISO strings written from them
+    return ms - ms % 1000, present
+
+
+def iso_column(ms: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Format epoch-ms values as ISO-8601 'Z' strings; missing values become None."""
+    iso = np.datetime_as_string(ms.astype("datetime64[ms]"), unit="s").astype(object) + "Z"
+    iso[~present] = None
+    return iso
+
+
+def map_rows(records: List[dict]) -> pd.DataFrame:
+    """Map raw export records to one row per conversation, column by column."""
+    created_ms, has_created = ms_column(records, "created_at")
+    answered_ms, has_answered = ms_column(records, "assigned_at")
+    queued_ms, has_queued = ms_column(records, "queued_at")
+    closed_ms, has_closed = ms_column(records, "closed_at")
+
+    ans1m = has_created & has_answered & ((answered_ms - created_ms) <= 60_000)
+    taken_from_queue = has_queued & has_answered
+    taken_from_forward = ~has_queued & has_answered
+    rejected_or_fwd = ~has_answered | taken_from_forward
+
+    queued_iso = iso_column(queued_ms, has_queued)
+    answered_iso = iso_column(answered_ms, has_answered)
+
+    return pd.DataFrame({
+        "id": [rec.get("id") for rec in records],
+        "createdAt": iso_column(created_ms, has_created),
+        "queued_at": queued_iso,
+        "assigned_at": answered_iso,
+        "answeredAt": answered_iso,
+        "queuedAt": queued_iso,
+        "closedAt": iso_column(closed_ms, has_closed),
+        # Low-cardinality text columns are stored as categoricals
+        "direction": pd.Categorical([rec.get("direction") or "" for rec in records]),
+        "channel": pd.Categorical([(rec.get("initial_channel") or "").lower() for rec in records]),
+        "assigneeName": pd.Categorical([rec.get("assignee_name") for rec in records]),
+        "queueName": pd.Categorical([rec.get("queue_name") for rec in records]),
+        "AnsweredWithin1Min": ans1m,
+        "TakenFromQueue": taken_from_queue,
+        "TakenFromForward": taken_from_forward,
+        "RejectedOrForwarded": rejected_or_fwd,
+        # Raw epoch-ms (MISSING_MS when absent) so compute_columns need not re-parse ISO strings
+        "createdAt_ms": np.where(has_created, created_ms, MISSING_MS),
+        "queuedAt_ms": np.where(has_queued, queued_ms, MISSING_MS),
+        "assigned_at_ms": np.where(has_answered, answered_ms, MISSING_MS),
+        "answeredAt_ms": np.where(has_answered, answered_ms, MISSING_MS),
+        "closedAt_ms": np.where(has_closed, closed_ms, MISSING_MS),
+    })
 
 
 def date_windows(start_d: date, end_d: date, step_days: int):
@@ -259,52 +380,206 @@ def date_windows(start_d: date, end_d: date, step_days: int):
         cur = win_end + timedelta(days=1)
 
 
-def fetch_exports_window(win_start_d: date, win_end_d: date, max_retries: int = 6) -> List[Dict[str, Any]]:
-    import requests
+def window_cache_path(win_start_d: date, win_end_d: date) -> Optional[Path]:
+    """Cache file for a settled window; None when the window is too recent to cache."""
+    if (datetime.now(timezone.utc).date() - win_end_d).days < CACHE_MIN_AGE_DAYS:
+        return None
+    return CACHE_DIR / f"{win_start_d.isoformat()}__{win_end_d.isoformat()}.json.gz"
+
+
+def write_window_cache(path: Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(gzip.compress(content, compresslevel=6))
+    os.replace(tmp, path)  # atomic, so a crash never leaves a truncated cache file
+
+
+def fetch_exports_window(win_start_d: date, win_end_d: date, max_retries: int = 6,
+                         use_cache: bool = True) -> Optional[List[Dict[str, Any]]]:
+    """Export records of one window; None when the window could not be fetched."""
+    cache_path = window_cache_path(win_start_d, win_end_d) if use_cache else None
+    if cache_path is not None and cache_path.exists():
+        try:
+            data = json_loads(gzip.decompress(cache_path.read_bytes()))
+            return data if isinstance(data, list) else data.get("data", [])
+        except (OSError, EOFError, ValueError, AttributeError):
+            # Truncated or corrupt cache file: drop it and fetch the window again
+            print(f"Ignoring unreadable cache file {cache_path}")
+            cache_path.unlink(missing_ok=True)
+
     created_after = win_start_d.isoformat()
     created_before = win_end_d.isoformat()
-    fields = (
-        "id,initial_channel,direction,created_at,queued_at,assigned_at,closed_at,"
-        "queue_id,queue_name,assignee_id,assignee_name"
-    )
     url = (
         f"{BASE_EXPORTS}/conversation_export?created_after={created_after}&created_before={created_before}"
-        f"&fields={fields}"
+        f"&fields={EXPORT_FIELDS}"
     )
     delay = BASE_DELAY
     tries = 0
     while True:
-        r = requests.get(url, headers=HEADERS_EXPORTS, timeout=60)
+        EXPORTS_LIMITER.acquire()
+        r = get_session().get(url, headers=HEADERS_EXPORTS, timeout=60)
         if r.status_code == 200:
             try:
-                data = r.json()
+                data = json_loads(r.content)
             except Exception:
-                return []
+                print("Exports API did not return JSON")
+                return None
+            if cache_path is not None:
+                write_window_cache(cache_path, r.content)
             return data if isinstance(data, list) else data.get("data", [])
         if r.status_code == 429:
-            ra = r.headers.get("Retry-After")
-            try:
-                wait = float(ra) if ra else delay
-            except Exception:
-                wait = delay
-            wait = max(wait, BASE_DELAY)
+            EXPORTS_LIMITER.slow_down()
+            wait = max(retry_after_seconds(r, delay), BASE_DELAY)
             print(f"429 rate limited, waiting {wait:.1f}s ...")
             time.sleep(wait)
             tries += 1
             delay = min(delay * 1.5, 60)
             if tries >= max_retries:
                 print("Giving up window due to repeated 429")
-                return []
+                return None
             continue
         if 500 <= r.status_code < 600:
+            print(f"Exports HTTP {r.status_code}, retrying in {delay:.1f}s ...")
             time.sleep(delay)
             tries += 1
+            delay = min(delay * 1.5, 60)
             if tries >= max_retries:
-                print(f"Server error {r.status_code}, giving up")
-                return []
+                print(f"Server error {r.status_code}, giving up window")
+                return None
             continue
         print(f"Exports HTTP {r.status_code}: {r.text[:200]}")
-        return []
+        return None
+
+
+_cache_db = None
+_cache_lock = threading.Lock()  # windows are enriched on several threads
+_cache_pending: List[Tuple[str, Any, Any, int]] = []
+
+
+def get_cache_db() -> sqlite3.Connection:
+    global _cache_db
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(DETAIL_CACHE_PATH, check_same_thread=False)
+        _cache_db.execute("PRAGMA journal_mode=WAL")
+        _cache_db.execute("PRAGMA synchronous=NORMAL")
+        _cache_db.execute("CREATE TABLE IF NOT EXISTS d(id TEXT PRIMARY KEY, state TEXT, json BLOB, fetched_at INTEGER)")
+    return _cache_db
+
+
+def get_cached_details(conv_ids: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """Cached details (by str id) of conversations already in a terminal state."""
+    keys = [str(c) for c in conv_ids if c]
+    found: Dict[str, Dict[str, Any]] = {}
+    with _cache_lock:
+        db = get_cache_db()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = db.execute(
+                f"SELECT id, state, json FROM d WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for key, state, blob in rows:
+                if (state or "").lower() in TERMINAL_STATES:
+                    found[key] = json_loads(blob)
+    return found
+
+
+def store_details(items: List[Tuple[Any, Dict[str, Any]]]) -> None:
+    now = int(time.time())
+    with _cache_lock:
+        _cache_pending.extend((str(c), det.get("state"), json_dumps(det), now) for c, det in items)
+        # Write in batches; one commit per insert would pay an fsync per detail
+        if len(_cache_pending) >= 500:
+            _flush_pending()
+
+
+def flush_detail_cache() -> None:
+    with _cache_lock:
+        _flush_pending()
+
+
+def _flush_pending() -> None:
+    if not _cache_pending:
+        return
+    db = get_cache_db()
+    with db:
+        db.executemany("INSERT OR REPLACE INTO d VALUES(?,?,?,?)", _cache_pending)
+    _cache_pending.clear()
+
+
+DETAIL_COLS = ["assignment.assignedAt", "assignment.reason", "assignment.offeredAt"]
+
+
+def fetch_window_rows(w_start: date, w_end: date, channel: Optional[str], detail_pool: ThreadPoolExecutor,
+                      use_cache: bool = True) -> Optional[pd.DataFrame]:
+    """Fetch, map, filter and enrich one window; None when the window could not be fetched."""
+    rows_raw = fetch_exports_window(w_start, w_end, use_cache=use_cache)
+    if rows_raw is None:
+        return None
+    if not rows_raw:
+        return pd.DataFrame()
+
+    df = map_rows(rows_raw)
+    if (channel or "") != "":
+        df = df[df["channel"] == str(channel).lower()].reset_index(drop=True)
+
+    if not ENRICH_DETAILS:
+        # Without details: queue when queued and assigned, forward when assigned without a queue
+        df["assignment.reason"] = np.where(df["TakenFromQueue"].to_numpy(), "queue",
+                                           np.where(df["TakenFromForward"].to_numpy(), "forward", None))
+        return df
+
+    # Detail enrichment per conversation id: closed conversations come from the SQLite
+    # cache, the rest are fetched concurrently (paced by DETAIL_LIMITER)
+    ids = df["id"].tolist()
+    cached = get_cached_details(ids) if use_cache else {}
+    to_fetch = [c for c in dict.fromkeys(ids) if c and str(c) not in cached]
+    fetched = dict(zip(to_fetch, detail_pool.map(fetch_detail, to_fetch)))
+    store_details([(c, det) for c, det in fetched.items() if det])
+
+    answered = df["answeredAt"].to_numpy(copy=True)
+    answered_ms = df["answeredAt_ms"].to_numpy(copy=True)
+    enriched: Dict[str, List[Any]] = {}
+    for i, conv_id in enumerate(ids):
+        det = cached.get(str(conv_id)) or fetched.get(conv_id)
+        if not det:
+            continue
+        ans = det.get("answeredAt")
+        if ans:
+            try:
+                answered_ms[i] = round(parse_iso_utc(ans).timestamp() * 1000)
+                answered[i] = ans
+            except (ValueError, TypeError, AttributeError):
+                pass  # malformed timestamp: keep the export's assigned_at
+        assignment = det.get("assignment") or {}
+        fields = {"assignment.assignedAt": assignment.get("assignedAt"), "assignment.reason": assignment.get("reason")}
+        if "offeredAt" in assignment:
+            fields["assignment.offeredAt"] = assignment.get("offeredAt")
+        for col, val in fields.items():
+            enriched.setdefault(col, [None] * len(df))[i] = val
+
+    df["answeredAt"] = answered
+    df["answeredAt_ms"] = answered_ms
+    # A detail column only exists when some detail response filled it, so windows
+    # without details keep the plain export columns
+    for col in DETAIL_COLS:
+        if col in enriched:
+            df[col] = enriched[col]
+    return df
+
+
+REASON_CATEGORIES = ["", "queue", "forward", "rejected"]
+CALL_TYPES = ["direct", "queue", "forward"]
+
+
+def to_epoch_ns(s: pd.Series) -> np.ndarray:
+    """Return a UTC datetime Series as int64 epoch nanoseconds (NaT -> NAT_NS)."""
+    return s.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").view("int64")
+
+
+def seconds_between(start_ns: np.ndarray, end_ns: np.ndarray) -> np.ndarray:
+    """(end - start) in float seconds; NaN where either side is missing."""
+    missing = (start_ns == NAT_NS) | (end_ns == NAT_NS)
+    return np.where(missing, np.nan, (end_ns - start_ns) / 1e9)
 
 
 def compute_columns(df: pd.DataFrame) -> pd.DataFrame:
@@ -318,92 +593,196 @@ def compute_columns(df: pd.DataFrame) -> pd.DataFrame:
         ]:
             if col not in df.columns:
                 df[col] = pd.Series(dtype="bool")
-        return df
-
-    # Parse datetimes using Series(values) to avoid DatetimeArray/ndarray mismatches
-    def to_dt_series(col: str) -> pd.Series:
+        return df.drop(columns=MS_COLS, errors="ignore")
+
+    def epoch_ns(col: str) -> np.ndarray:
+        # Prefer the raw epoch-ms column from map_rows; parse the ISO strings otherwise
+        ms_col = f"{col}_ms"
+        if ms_col in df.columns:
+            ms = df[ms_col].to_numpy(dtype=np.int64)
+            return np.where(ms == MISSING_MS, NAT_NS, ms * 1_000_000)
         if col in df.columns:
             s = pd.Series(df[col].values, index=df.index)
-            return pd.to_datetime(s, utc=True, errors="coerce")
-        # Return an empty datetime64[ns, UTC] series to ensure aligned dtypes
-        empty_idx = pd.DatetimeIndex([pd.NaT] * len(df), tz="UTC")
-        return pd.Series(empty_idx, index=df.index)
-
-    created = to_dt_series("createdAt")
-    answered = to_dt_series("answeredAt")
-    assigned_plain = to_dt_series("assigned_at") if "assigned_at" in df.columns else pd.Series(pd.NaT, index=df.index)
-    closed = to_dt_series("closedAt")
-    queued = to_dt_series("queuedAt")
-    assigned_detail = to_dt_series("assignment.assignedAt")
+            return to_epoch_ns(pd.to_datetime(s, utc=True, errors="coerce"))
+        return np.full(len(df), NAT_NS, dtype=np.int64)
 
-    # Ensure the DataFrame columns themselves are UTC datetimes (per requirement)
-    df["closedAt"] = closed
-    df["answeredAt"] = answered
-    if "assigned_at" in df.columns:
-        df["assigned_at"] = assigned_plain
+    def to_dt_series(ns: np.ndarray) -> pd.Series:
+        return pd.Series(pd.DatetimeIndex(ns.view("datetime64[ns]")).tz_localize("UTC"), index=df.index)
+
+    created_ns = epoch_ns("createdAt")
+    answered_ns = epoch_ns("answeredAt")
+    assigned_ns = epoch_ns("assigned_at")
+    closed_ns = epoch_ns("closedAt")
+    queued_ns = epoch_ns("queuedAt")
+    assigned_detail_ns = epoch_ns("assignment.assignedAt")
 
-    # Bepaal call origin
-    assignment_reason = df["assignment.reason"].str.lower().fillna("") if "assignment.reason" in df.columns else pd.Series([""] * len(df), index=df.index)
-    df["CallType"] = np.where(df["TakenFromQueue"], "queue",
-                        np.where(df["TakenFromForward"], "forward", "direct"))
+    # Ensure the DataFrame columns themselves are UTC datetimes (per requirement)
+    df["closedAt"] = to_dt_series(closed_ns)
+    df["answeredAt"] = to_dt_series(answered_ns)
+    df["assigned_at"] = to_dt_series(assigned_ns)
 
-    # Computed using enriched fields where available
-    within_1m = (answered - created).dt.total_seconds() <= 60
-    within_1m = within_1m.fillna(False)
+    # Computed using enriched fields where available (int64 ns arithmetic, NaT -> False)
+    within_1m = (created_ns != NAT_NS) & (answered_ns != NAT_NS) & ((answered_ns - created_ns) <= 60_000_000_000)
 
-    # Prefer 'assignment.reason' if present; fallback to 'assignmentReason'; else empty string
     if "assignment.reason" in df.columns:
         assignment_reason_series = df["assignment.reason"].fillna("")
-    elif "assignmentReason" in df.columns:
-        assignment_reason_series = df["assignmentReason"].fillna("")
     else:
         assignment_reason_series = pd.Series([""] * len(df), index=df.index)
 
-    assignment_reason_lower = assignment_reason_series.astype(str).str.lower()
-    taken_from_queue = assignment_reason_lower == "queue"
-    taken_from_forward = assignment_reason_lower == "forward"
-    rejected_or_forwarded = answered.isna() | assignment_reason_lower.isin(["forward", "rejected"])  # type: ignore[attr-defined]
-
-    # Ensure pandas datetimes (UTC) for other computations and compute CallDurationSec here
-    df["closedAt"] = pd.to_datetime(df["closedAt"], utc=True, errors="coerce")
-    df["answeredAt"] = pd.to_datetime(df["answeredAt"], utc=True, errors="coerce")
-    if "assigned_at" in df.columns:
-        df["assigned_at"] = pd.to_datetime(df["assigned_at"], utc=True, errors="coerce")
-    # Primary: closedAt - answeredAt in seconds (using DataFrame columns)
-    df["CallDurationSec"] = (df["closedAt"] - df["answeredAt"]).dt.total_seconds()
-    # Fallback: where answeredAt is missing, use assigned_at when available
-    if "assigned_at" in df.columns:
-        fallback = (df["closedAt"] - df["assigned_at"]).dt.total_seconds()
-        df["CallDurationSec"] = df["CallDurationSec"].fillna(fallback)
+    # Compare reasons as int8 category codes (-1 for reasons outside REASON_CATEGORIES)
+    reason_codes = pd.Categorical(assignment_reason_series.astype(str).str.lower(), categories=REASON_CATEGORIES).codes
+    taken_from_queue = reason_codes == 1
+    taken_from_forward = reason_codes == 2
+    rejected_or_forwarded = (answered_ns == NAT_NS) | (reason_codes >= 2)
+
+    # Bepaal call origin: forward if assignment.reason == 'forward'; queue if queuedAt exists; else direct
+    call_type_codes = np.where(taken_from_forward, 2, np.where(queued_ns != NAT_NS, 1, 0)).astype(np.int8)
+    df["CallType"] = pd.Categorical.from_codes(call_type_codes, categories=CALL_TYPES)
+
+    # CallDurationSec: closedAt - answeredAt in seconds, falling back to assigned_at
+    duration = seconds_between(answered_ns, closed_ns)
+    df["CallDurationSec"] = np.where(np.isnan(duration), seconds_between(assigned_ns, closed_ns), duration)
 
     df["AnsweredWithin1Min"] = within_1m
     df["TakenFromQueue"] = taken_from_queue
     df["TakenFromForward"] = taken_from_forward
     df["RejectedOrForwarded"] = rejected_or_forwarded
 
-    # CallType: queue if queuedAt exists; forward if assignment.reason == 'forward'; else direct
-    call_type = pd.Series("direct", index=df.index)
-    call_type = call_type.mask(~queued.isna(), "queue")
-    call_type = call_type.mask(assignment_reason_lower == "forward", "forward")
-    df["CallType"] = call_type
-
     # Binnen1MinFair: FairTTASeconds <= 60 and CallType == 'direct'
     fair = pd.to_numeric(df.get("FairTTASeconds"), errors="coerce") if "FairTTASeconds" in df.columns else pd.Series([pd.NA] * len(df), index=df.index)
     df["Binnen1MinFair"] = (fair <= 60) & (df["CallType"] == "direct")
 
-    # CallDurationSec already computed above
-
     # FairTTASeconds: time-to-answer from queuedAt (fallback createdAt) to answeredAt (fallback assignment.assignedAt)
-    effective_answered = answered.combine_first(assigned_detail)
-    start_time = queued.combine_first(created)
-    # Compute fair seconds using datetime-aware Series with aligned dtypes
-    effective_answered = answered.where(~answered.isna(), assigned_detail)
-    start_time = queued.where(~queued.isna(), created)
-    fair_seconds = (effective_answered - start_time).dt.total_seconds()
-    fair_seconds = fair_seconds.where(~effective_answered.isna(), other=pd.NA)
-    df["FairTTASeconds"] = fair_seconds
+    effective_answered_ns = np.where(answered_ns == NAT_NS, assigned_detail_ns, answered_ns)
+    start_ns = np.where(queued_ns == NAT_NS, created_ns, queued_ns)
+    df["FairTTASeconds"] = seconds_between(start_ns, effective_answered_ns)
+
+    return df.drop(columns=MS_COLS, errors="ignore")
+
+
+# Columns (in order) of the single-file export
+REQUIRED_COLS = [
+    "createdAt",
+    "queued_at",
+    "assigned_at",
+    "answeredAt",
+    "assignmentReason",
+    "AnsweredWithin1Min",
+    "TakenFromQueue",
+    "TakenFromForward",
+    "RejectedOrForwarded",
+    "FairTTASeconds",
+    "CallDurationSec",
+    "CallType",
+    "Binnen1MinFair",
+]
+
+
+# Export columns filled from a differently named frame column
+EXPORT_SOURCE_COLS = {"assignmentReason": "assignment.reason"}
+
+
+def export_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Project computed rows onto REQUIRED_COLS for the single-file export."""
+    cols = {c: EXPORT_SOURCE_COLS.get(c, c) for c in REQUIRED_COLS}
+    # Detail-only columns are absent when no detail came back; they export empty
+    return pd.DataFrame({c: df[src] if src in df.columns else None for c, src in cols.items()}, index=df.index)
+
+
+# Timestamp columns kept typed (timestamp[ns, UTC]) in the Parquet export
+PARQUET_TIME_COLS = ["createdAt", "queued_at", "assigned_at", "answeredAt"]
+PARQUET_BOOL_COLS = ["AnsweredWithin1Min", "TakenFromQueue", "TakenFromForward", "RejectedOrForwarded", "Binnen1MinFair"]
+
+
+def parquet_schema() -> "pa.Schema":
+    """Fixed schema for REQUIRED_COLS, so windows with all-empty columns still match."""
+    types = {c: pa.timestamp("ns", tz="UTC") for c in PARQUET_TIME_COLS}
+    types.update({c: pa.bool_() for c in PARQUET_BOOL_COLS})
+    types.update({"FairTTASeconds": pa.float64(), "CallDurationSec": pa.float64()})
+    return pa.schema([(c, types.get(c, pa.string())) for c in REQUIRED_COLS])
+
+
+def parquet_table(df_export: pd.DataFrame, schema: "pa.Schema") -> "pa.Table":
+    """Convert one window's export frame to an Arrow table with typed timestamps."""
+    df = df_export.copy()
+    for c in PARQUET_TIME_COLS:
+        df[c] = pd.to_datetime(df[c], utc=True, errors="coerce").astype("datetime64[ns, UTC]")
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+PARQUET_DATASET_DIR = Path("data/dixa_parquet")
+
+
+def write_parquet_partitions(table: "pa.Table", ids: List[Any]) -> None:
+    """Merge one window into the hive-partitioned (year=/month=) Parquet dataset.
+
+    Every month the window touches is rewritten whole: stored rows of the same
+    conversation id are replaced, so reruns with shifted windows never duplicate rows.
+    """
+    table = table.add_column(0, "id", pa.array([str(c) for c in ids], pa.string()))
+    created = table.column("createdAt").to_numpy().astype("datetime64[M]").astype(np.int64)
+    years = 1970 + created // 12
+    months = created % 12 + 1
+
+    merged = []
+    for year, month in sorted(set(zip(years.tolist(), months.tolist()))):
+        new = table.filter(pa.array((years == year) & (months == month)))
+        part_dir = PARQUET_DATASET_DIR / f"year={year}" / f"month={month}"
+        if part_dir.exists():
+            old = ds.dataset(part_dir, format="parquet", schema=table.schema).to_table()
+            old = old.filter(pc.invert(pc.is_in(old.column("id"), value_set=new.column("id"))))
+            new = pa.concat_tables([old, new]).sort_by("createdAt")
+        new = new.append_column("year", pa.array([year] * len(new), pa.int16()))
+        merged.append(new.append_column("month", pa.array([month] * len(new), pa.int8())))
+
+    ds.write_dataset(
+        pa.concat_tables(merged),
+        PARQUET_DATASET_DIR,
+        format="parquet",
+        partitioning=["year", "month"],
+        partitioning_flavor="hive",
+        basename_template="conversations-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
 
-    return df
+
+def results_in_order(ex: ThreadPoolExecutor, fn, windows: List[Tuple[date, date]], ahead: int):
+    """Yield (w_start, w_end, fn(w_start, w_end)) in window order while the pool works ahead.
+
+    At most `ahead` windows are submitted but not yet consumed, and a future is dropped
+    once its result is yielded, so finished window frames cannot pile up in memory.
+    """
+    pending = deque()
+    for w_start, w_end in windows:
+        pending.append((w_start, w_end, ex.submit(fn, w_start, w_end)))
+        if len(pending) >= ahead:
+            w0, w1, fut = pending.popleft()
+            yield w0, w1, fut.result()
+    while pending:
+        w0, w1, fut = pending.popleft()
+        yield w0, w1, fut.result()
+
+
+# Checkpoint of the current run, removed again once the run completes. The ids already
+# written are appended to a sidecar (one JSON value per line) so the state stays small.
+EXPORT_STATE_PATH = Path("data/.export_state.json")
+EXPORT_IDS_PATH = Path("data/.export_state.ids")
+
+
+def load_export_state(run_key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Checkpoint left by an interrupted run with the same arguments, else None."""
+    try:
+        state = json_loads(EXPORT_STATE_PATH.read_bytes())
+    except (OSError, ValueError):
+        return None
+    return state if state.get("run") == run_key else None
+
+
+def save_export_state(state: Dict[str, Any]) -> None:
+    EXPORT_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = EXPORT_STATE_PATH.with_suffix(".tmp")
+    tmp.write_bytes(json_dumps(state))
+    os.replace(tmp, EXPORT_STATE_PATH)
 
 
 def main(argv: Optional[List[str]] = None) -> None:
@@ -412,10 +791,10 @@ def main(argv: Optional[List[str]] = None) -> None:
 
     start_dt, end_dt, label, args = determine_range_from_cli(argv)
 
-    # Debug channel
-    ch_dbg = "ALL" if (args.channel or "").strip()=="" else args.channel
-    print(f"channel={ch_dbg}")
-    sys.stdout.flush()
+    if DEBUG:
+        ch_dbg = "ALL" if (args.channel or "").strip()=="" else args.channel
+        print(f"channel={ch_dbg}")
+        sys.stdout.flush()
 
     start_d = normalize_date_only(start_dt)
     end_d = normalize_date_only(end_dt)
@@ -424,122 +803,170 @@ def main(argv: Optional[List[str]] = None) -> None:
     print(f"Fetching days: {start_d.isoformat()} -> {end_d.isoformat()} (inclusive), total days: {total_days}")
     sys.stdout.flush()
 
-    all_rows: List[Dict[str, Any]] = []
+    # Windows can overlap at the edges; drop repeated ids as rows arrive
+    seen_ids = set()
+    removed = 0
+    # Single-file output is streamed per window; only the summary counters are kept
+    single_fp = None
+    write_csv = args.format in ("csv", "both")
+    # Parquet is appended per window too (one row group per window)
+    parquet_writer = None
+    total_calls = calls_1m = not_answered_or_fwd = from_queue = from_forward = 0
 
-    processed = 0
     # Output mode: default single-file unless --daily-files explicitly set
     write_daily = bool(args.daily_files)
     write_single = bool(args.single_file) or not write_daily
 
+    # Checkpoint after every window so an interrupted run can resume. A single Parquet
+    # file cannot be reopened for appending, so that output always starts over.
+    resumable = not (args.single_file and args.format != "csv" and not args.partitioned)
+    run_key = {
+        "start": start_d.isoformat(), "end": end_d.isoformat(), "channel": args.channel or "",
+        "window_days": WINDOW_DAYS, "single_file": bool(args.single_file), "daily_files": write_daily,
+        "format": args.format, "partitioned": bool(args.partitioned), "enrich_details": ENRICH_DETAILS,
+    }
+    state = load_export_state(run_key) if resumable and not args.no_resume else None
+    if state and ((state.get("csv_size") is not None and not Path("conversations_ytd.csv").exists())
+                  or (state.get("ids_size") is not None and not EXPORT_IDS_PATH.exists())):
+        state = None  # checkpointed rows are gone; start over
+    completed = set(state["completed"]) if state else set()
+    ids_fp = None
+    if state:
+        if state.get("ids_size") is not None:
+            ids_fp = open(EXPORT_IDS_PATH, "r+b")
+            ids_fp.truncate(state["ids_size"])
+            seen_ids = {json_loads(line) for line in ids_fp.read().splitlines()}
+        total_calls, calls_1m, not_answered_or_fwd, from_queue, from_forward, removed = state["counts"]
+        if state.get("csv_size") is not None:
+            # Drop anything written after the last checkpoint, then keep appending
+            single_fp = open("conversations_ytd.csv", "r+", encoding="utf-8", newline="")
+            single_fp.seek(state["csv_size"])
+            single_fp.truncate()
+    elif resumable and write_single:
+        EXPORT_IDS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        ids_fp = open(EXPORT_IDS_PATH, "wb")
+
     # Ensure output directory for daily mode
     daily_dir = Path("data/dixa_daily")
     daily_dir.mkdir(parents=True, exist_ok=True)
 
-    for (w_start, w_end) in date_windows(start_d, end_d, WINDOW_DAYS):
-        processed += 1
-        win_label = f"{w_start.isoformat()}->{w_end.isoformat()}"
-        print(f"Window {win_label} ...", end=" ")
-        sys.stdout.flush()
-
-        rows_raw = fetch_exports_window(w_start, w_end)
-        if not rows_raw:
-            print("no rows (skipping write)")
-            sys.stdout.flush()
-            time.sleep(BASE_DELAY)
-            continue
-
-        rows = [map_row(x) for x in rows_raw]
-        if (args.channel or "") != "":
-            rows = [r for r in rows if (r.get("channel") or "") == str(args.channel).lower()]
-
-        # Detail enrichment per conversation id
-        for r in rows:
-            conv_id = r.get("id")
-            if not conv_id:
-                continue
-            try:
-                det = fetch_detail(conv_id)
-            except Exception:
-                det = None
-            if not det:
-                continue
-            ans = det.get("answeredAt")
-            if ans:
-                r["answeredAt"] = ans
-            assignment = det.get("assignment") or {}
-            r["assignment.assignedAt"] = assignment.get("assignedAt")
-            r["assignment.reason"] = assignment.get("reason")
-            if "offeredAt" in assignment:
-                r["assignment.offeredAt"] = assignment.get("offeredAt")
-            time.sleep(0.1)
-
-        print(f"{len(rows)} rows")
-        sys.stdout.flush()
-
-        if write_daily and rows:
+    def process_window(w_start: date, w_end: date) -> Optional[pd.DataFrame]:
+        # Computed columns are added once per window on the worker thread and shared by
+        # the daily file and the single-file export; daily files are written here too
+        df_rows = fetch_window_rows(w_start, w_end, args.channel, detail_pool, use_cache=not args.no_cache)
+        if df_rows is None or df_rows.empty:
+            return df_rows
+        df_rows = compute_columns(df_rows)
+        if write_daily:
             out = daily_dir / f"conversations_{w_start.isoformat()}__{w_end.isoformat()}.csv"
-            df_day = pd.DataFrame(rows)
-            df_day = compute_columns(df_day)
-            df_day.to_csv(out, index=False, encoding="utf-8")
-        if write_single and rows:
-            all_rows.extend(rows)
+            df_rows.to_csv(out, index=False, encoding="utf-8")
+        return df_rows
+
+    # Fetch windows in parallel (daily files are written as each one finishes); the
+    # single-file output is written in window order so rows and kept duplicates are stable
+    windows = list(date_windows(start_d, end_d, WINDOW_DAYS))
+    failed: List[str] = []
+    if completed:
+        print(f"Resuming: {len(completed)} of {len(windows)} windows already done")
+        windows = [w for w in windows if f"{w[0].isoformat()}->{w[1].isoformat()}" not in completed]
+    ex = ThreadPoolExecutor(max_workers=WINDOW_WORKERS)
+    # Shared by all windows of this run so its threads (and their thread-local sessions) are reused
+    detail_pool = ThreadPoolExecutor(max_workers=DETAIL_CONCURRENCY, thread_name_prefix="detail")
+    try:
+        for w_start, w_end, df_rows in results_in_order(ex, process_window, windows, 2 * WINDOW_WORKERS):
+            win_label = f"{w_start.isoformat()}->{w_end.isoformat()}"
+            print(f"Window {win_label} ...", end=" ")
+            if df_rows is None:
+                # Not checkpointed, so the next run with the same arguments fetches it again
+                print("failed (skipping write)")
+                failed.append(win_label)
+                sys.stdout.flush()
+                continue
+            if df_rows.empty:
+                print("no rows (skipping write)")
+            else:
+                print(f"{len(df_rows)} rows")
+            sys.stdout.flush()
 
-        time.sleep(BASE_DELAY)
+            keep = np.zeros(0, dtype=bool)
+            if write_single and not df_rows.empty:
+                keep = np.ones(len(df_rows), dtype=bool)
+                for i, conv_id in enumerate(df_rows["id"]):
+                    if conv_id in seen_ids:
+                        keep[i] = False
+                        removed += 1
+                        continue
+                    seen_ids.add(conv_id)
+
+            if keep.any():
+                df_win = df_rows[keep].reset_index(drop=True)
+                if ids_fp is not None:
+                    ids_fp.write(b"".join(json_dumps(c) + b"\n" for c in df_win["id"].tolist()))
+                total_calls += len(df_win)
+                calls_1m += int(df_win["AnsweredWithin1Min"].sum())
+                not_answered_or_fwd += int(df_win["RejectedOrForwarded"].sum())
+                from_queue += int(df_win["TakenFromQueue"].sum())
+                from_forward += int(df_win["TakenFromForward"].sum())
+
+                # Write CSV (single file), appending one window at a time
+                if args.single_file:
+                    df_export = export_frame(df_win)
+                    if write_csv:
+                        if single_fp is None:
+                            single_fp = open("conversations_ytd.csv", "w", encoding="utf-8", newline="")
+                        df_export.to_csv(single_fp, index=False, header=single_fp.tell() == 0)
+                    if args.partitioned:
+                        write_parquet_partitions(parquet_table(df_export, parquet_schema()), df_win["id"].tolist())
+                    elif args.format != "csv":
+                        if parquet_writer is None:
+                            schema = parquet_schema()
+                            parquet_writer = pq.ParquetWriter("conversations_ytd.parquet", schema, compression="snappy")
+                        parquet_writer.write_table(parquet_table(df_export, schema), row_group_size=64_000)
+
+            if resumable:
+                for fp in (single_fp, ids_fp):
+                    if fp is not None:
+                        fp.flush()
+                completed.add(win_label)
+                save_export_state({
+                    "run": run_key,
+                    "completed": sorted(completed),
+                    "counts": [total_calls, calls_1m, not_answered_or_fwd, from_queue, from_forward, removed],
+                    "csv_size": single_fp.tell() if single_fp is not None else None,
+                    "ids_size": ids_fp.tell() if ids_fp is not None else None,
+                })
+    except BaseException:
+        # On an error or Ctrl+C, don't wait for the windows still queued
+        ex.shutdown(wait=False, cancel_futures=True)
+        detail_pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    ex.shutdown()
+    detail_pool.shutdown()
+
+    flush_detail_cache()
+    if single_fp is not None:
+        single_fp.close()
+    if parquet_writer is not None:
+        parquet_writer.close()
+    if ids_fp is not None:
+        ids_fp.close()
+    if failed:
+        print(f"\n{len(failed)} window(s) failed: {', '.join(failed)}")
+        if resumable:
+            print("Run again with the same arguments to fetch only these windows")
+        sys.exit(1)
+    # Run completed: the next run starts fresh
+    EXPORT_STATE_PATH.unlink(missing_ok=True)
+    EXPORT_IDS_PATH.unlink(missing_ok=True)
 
     if write_single:
-        if not all_rows:
+        if not total_calls:
             print("No conversations found for the selected range.")
             return
 
-        # Build DataFrame and drop duplicate ids
-        df = pd.DataFrame(all_rows)
-        if "id" in df.columns:
-            before = len(df)
-            df = df.drop_duplicates(subset=["id"]).reset_index(drop=True)
-            removed = before - len(df)
-            if removed:
-                print(f"Removed {removed} duplicate ids")
-                sys.stdout.flush()
-
-        # Add computed columns
-        df = compute_columns(df)
-        df_all = df
-
-        # Write CSV (single file)
-        if args.single_file:
-            # Ensure required export columns exist and in order
-            required_cols = [
-                "createdAt",
-                "queued_at",
-                "assigned_at",
-                "answeredAt",
-                "assignmentReason",
-                "AnsweredWithin1Min",
-                "TakenFromQueue",
-                "TakenFromForward",
-                "RejectedOrForwarded",
-                "FairTTASeconds",
-                "CallDurationSec",
-                "CallType",
-                "Binnen1MinFair",
-            ]
-            # Backfill assignmentReason from assignment.reason if missing
-            if "assignmentReason" not in df_all.columns and "assignment.reason" in df_all.columns:
-                df_all["assignmentReason"] = df_all["assignment.reason"]
-            # Add any missing required columns as empty
-            for c in required_cols:
-                if c not in df_all.columns:
-                    df_all[c] = pd.NA
-            df_export = df_all.reindex(columns=required_cols)
-            out = "conversations_ytd.csv"
-            df_export.to_csv(out, index=False, encoding="utf-8")
-
-        # Summary
-        total_calls = len(df_all)
-        calls_1m = int(df_all["AnsweredWithin1Min"].sum()) if "AnsweredWithin1Min" in df_all.columns else 0
-        not_answered_or_fwd = int(df_all["RejectedOrForwarded"].sum()) if "RejectedOrForwarded" in df_all.columns else 0
-        from_queue = int(df_all["TakenFromQueue"].sum()) if "TakenFromQueue" in df_all.columns else 0
-        from_forward = int(df_all["TakenFromForward"].sum()) if "TakenFromForward" in df_all.columns else 0
+        if removed:
+            print(f"Removed {removed} duplicate ids")
+            sys.stdout.flush()
 
         print("\n" + "-" * 60)
         print("SUMMARY")